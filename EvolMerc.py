@@ -1,11 +1,19 @@
+import logging
+import os
+import threading
+import diskcache
 import streamlit as st
 import pandas as pd
-import yfinance as yf
 import numpy as np
-import pytz
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+from urllib.parse import quote
+from curl_cffi import requests as curl_requests
 from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from plotly.subplots import make_subplots
 import plotly.graph_objects as go
+from kernels import slopes_and_norm
 
 st.set_page_config(layout="wide", page_title="Dashboard Trading Pro")
 
@@ -24,148 +32,260 @@ ASSETS = {
     '^DJI':   {'name': 'Dow Jones',        'color': '#EC4899', 'unit': '',  'interval': '5m'},
     '^GDAXI': {'name': 'DAX',              'color': '#F59E0B', 'unit': '',  'interval': '15m'}
 }
-timezone_pt = pytz.timezone("Europe/Lisbon")
-
-def calculate_slope(prices):
-    if len(prices) < 2: return 0.0, 0.0
-    x = np.arange(len(prices))
-    y = np.array(prices, dtype=float)
-    coeffs = np.polyfit(x, y, 1)
-    slope = coeffs[0]
-    angle = np.arctan(slope) * (180 / np.pi)
-    return slope, angle
-
-def get_trend_info(angle):
-    if angle > 15: return "FORTE ALTA", "#10B981"
-    elif angle > 5: return "ALTA MODERADA", "#34D399"
-    elif angle > -5: return "LATERAL", "#FBBF24"
-    elif angle > -15: return "BAIXA MODERADA", "#FB923C"
-    else: return "FORTE BAIXA", "#EF4444"
-
-@st.cache_data(ttl=60, show_spinner="A carregar dados...")
-def fetch_asset_data(symbol, info):
-    end_time = datetime.now(timezone_pt)
-    start_time = end_time - timedelta(days=5)
-    df = yf.Ticker(symbol).history(start=start_time, end=end_time, interval=info['interval'])
-    if df is None or df.empty: return None
-    if df.index.tz is None: df.index = df.index.tz_localize('UTC')
-    df.index = df.index.tz_convert(timezone_pt)
-    closes = df['Close'].dropna()
-    if closes.empty: return None
-    prices = closes.tolist()
-    times = closes.index.tolist()
-    current_price = prices[-1]
-    previous_price = prices[0]
+timezone_pt = ZoneInfo("Europe/Lisbon")
+logger = logging.getLogger(__name__)
+
+# Classes de tendência por ângulo; right=True mantém os limites (ex.: 15° = ALTA MODERADA)
+TREND_BINS = np.array([-15.0, -5.0, 5.0, 15.0])
+TREND_LABELS = [("FORTE BAIXA", "#EF4444"), ("BAIXA MODERADA", "#FB923C"), ("LATERAL", "#FBBF24"), ("ALTA MODERADA", "#34D399"), ("FORTE ALTA", "#10B981")]
+
+def get_trend_info(angles):
+    return [TREND_LABELS[i] for i in np.digitize(angles, TREND_BINS, right=True)]
+
+# Endpoint de gráfico do Yahoo, chamado diretamente (sem a camada pandas do yfinance)
+CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+
+@st.cache_resource
+def get_disk_cache():
+    # Cache em disco partilhada entre processos: sobrevive a reinícios do Streamlit
+    return diskcache.Cache(os.path.join(os.path.dirname(os.path.abspath(__file__)), '.yfcache'))
+
+@st.cache_resource
+def get_http_session():
+    # Sessão única para todos os pedidos: reutiliza as ligações TLS ao Yahoo
+    return curl_requests.Session(impersonate="chrome")
+
+def fetch_chart(symbol, interval, end_time, cache, session):
+    # Só a cache em disco (expira aos 60s): uma cache em memória por cima voltaria a
+    # contar 60s a partir da leitura e serviria dados com até ~2 minutos.
+    # cache e session vêm do store: as threads do executor não têm ScriptRunContext
+    # e não devem chamar funções st.cache_resource
+    key = (symbol, interval)
+    chart = cache.get(key)
+    if chart is None:
+        start_time = end_time - timedelta(days=5)
+        params = {'interval': interval, 'period1': int(start_time.timestamp()), 'period2': int(end_time.timestamp())}
+        response = session.get(CHART_URL.format(symbol=quote(symbol, safe='')), params=params, timeout=10)
+        response.raise_for_status()
+        payload = response.json()['chart']
+        if payload.get('error'): raise ValueError(payload['error'].get('description', payload['error']))
+        result = payload['result'][0]
+        # JSON direto para arrays NumPy; fechos em falta (null) passam a NaN
+        timestamps = np.array(result.get('timestamp', []), dtype=np.int64)
+        closes = np.array(result['indicators']['quote'][0].get('close', []), dtype=np.float64)
+        if len(timestamps) != len(closes):
+            raise ValueError(f"resposta inválida ({len(timestamps)} horas para {len(closes)} fechos)")
+        chart = (timestamps, closes)
+        cache.set(key, chart, expire=60)
+    return build_asset_data(*chart)
+
+def build_asset_data(timestamps, closes):
+    valid = ~np.isnan(closes)
+    timestamps, closes = timestamps[valid], closes[valid]
+    if closes.size == 0: return None
+    times = pd.to_datetime(timestamps, unit='s', utc=True).tz_convert(timezone_pt)
+    # float32 chega para inclinação/normalização; preço e variação ficam em float64
+    prices = closes.astype(np.float32)
+    current_price = float(closes[-1])
+    previous_price = float(closes[0])
     change = current_price - previous_price
     change_pct = (change / previous_price) * 100 if previous_price else 0.0
-    slope, angle = calculate_slope(prices)
-    trend, trend_color = get_trend_info(angle)
-    return {'current_price': current_price, 'last_time': times[-1], 'change': change, 'change_pct': change_pct, 'trend': trend, 'trend_color': trend_color, 'angle': angle, 'prices': prices, 'times': times}
+    return {'current_price': current_price, 'last_time': times[-1], 'change': change, 'change_pct': change_pct, 'prices': prices, 'times': times}
+
+def compute_trends(data_store):
+    # Calcula tendência e curva normalizada de todos os ativos de uma vez
+    symbols = list(data_store)
+    if not symbols: return
+    lens = np.array([len(data_store[s]['prices']) for s in symbols], dtype=np.int64)
+    P = np.full((len(symbols), lens.max()), np.nan, dtype=np.float32)
+    for a, symbol in enumerate(symbols):
+        P[a, :lens[a]] = data_store[symbol]['prices']
+    slopes, angles, normalized = slopes_and_norm(P, lens)
+    trends = get_trend_info(angles)
+    for a, symbol in enumerate(symbols):
+        trend, trend_color = trends[a]
+        data_store[symbol].update(slope=slopes[a], angle=angles[a], trend=trend, trend_color=trend_color, normalized=normalized[a, :lens[a]])
 
-# Carrega os dados dos ativos
-data_store = {}
-for symbol, info in ASSETS.items():
+def _fetch(item, end_time, store):
+    symbol, info = item
     try:
-        data = fetch_asset_data(symbol, info)
+        return symbol, fetch_chart(symbol, info['interval'], end_time, store['disk_cache'], store['session']), None
     except Exception as e:
-        st.warning(f"Erro ao carregar {symbol}: {e}")
-        data = None
-    if data: data_store[symbol] = data
-
-# Header (botão update)
-col1, col2 = st.columns([1, 6])
-with col1:
-    if st.button("🔄 Atualizar Agora"):
-        st.cache_data.clear()
-        st.rerun()
-with col2:
-    now_pt = datetime.now(timezone_pt)
-    st.markdown(f"<p style='text-align: right; color: #6B7280; font-size: 14px;'>Última atualização: {now_pt.strftime('%d/%m/%Y %H:%M:%S')} (PT)</p>", unsafe_allow_html=True)
-
-# Cartões dos ativos
-cards_html = "<div style='display: flex; flex-wrap: wrap; justify-content: space-around; gap: 15px; padding: 20px;'>"
-for symbol, info in ASSETS.items():
-    data = data_store.get(symbol)
-    border_color = info['color']
-    card_bg = '#1F2937'
-    if not data:
-        cards_html += f"""
-        <div style='background: {card_bg}; padding: 20px; border-radius: 10px; border: 2px solid {border_color}; flex: 1; min-width: 260px; max-width: 300px; box-shadow: 0 4px 6px rgba(0,0,0,0.3);'>
-            <h3 style='color: white; margin: 0 0 10px 0; font-size: 18px;'>{info['name']}</h3>
-            <p style='color: #9CA3AF; font-size: 14px;'>Sem dados</p>
-        </div>"""
-        continue
-    price_str = f"{info['unit']}{data['current_price']:.2f}" if info['unit'] else f"{data['current_price']:.2f}"
-    hora_pt = data['last_time'].strftime("%d/%m %H:%M")
-    change_sign = "↑" if data['change'] >= 0 else "↓"
-    change_color = "#10B981" if data['change'] >= 0 else "#EF4444"
-    cards_html += f"""
-    <div style='background: {card_bg}; padding: 20px; border-radius: 10px; border: 2px solid {border_color}; box-shadow: 0 4px 6px rgba(0,0,0,0.3); flex: 1; min-width: 260px; max-width: 300px;'>
-        <h3 style='color: white; margin: 0 0 8px 0; font-size: 18px;'>{info['name']}</h3>
-        <div style='font-size: 28px; font-weight: bold; color: white; margin-bottom: 5px;'>{price_str}</div>
-        <div style='font-size: 12px; color: #9CA3AF; margin-bottom: 10px;'>{hora_pt} (PT)</div>
-        <div style='display: flex; justify-content: space-between; margin-bottom: 10px;'>
-            <span style='color: {change_color}; font-size: 16px;'>{change_sign} {abs(data['change']):.4f}</span>
-            <span style='color: {change_color}; font-size: 16px;'>({data['change_pct']:+.2f}%)</span>
-        </div>
-        <hr style='border-color: #374151; margin: 12px 0;'>
-        <div style='font-size: 14px; color: #9CA3AF;'>Tendência: <span style='color: {data['trend_color']}; font-weight: bold;'>{data['trend']}</span></div>
-        <div style='font-size: 14px; color: #9CA3AF; margin-top: 5px;'>Inclinação: <span style='color: white; font-weight: bold;'>{data['angle']:.1f}°</span></div>
-    </div>"""
-cards_html += "</div>"
-st.markdown(cards_html, unsafe_allow_html=True)
+        return symbol, None, e
+
+def load_data_store(store, end_time):
+    # Carrega os dados dos ativos em paralelo (um pedido por ativo). O executor vive tanto
+    # quanto o atualizador: a sessão curl_cffi tem um handle por thread, e só threads
+    # reutilizadas entre ciclos reaproveitam as ligações TLS já abertas
+    data_store, errors = {}, []
+    results = list(store['executor'].map(_fetch, ASSETS.items(), repeat(end_time), repeat(store)))
+    for symbol, data, error in results:
+        if error is not None:
+            errors.append(f"Erro ao carregar {symbol}: {error}")
+            continue
+        if data: data_store[symbol] = data
+    compute_trends(data_store)
+    return data_store, errors
+
+def refresh_store(store):
+    # Uma só leitura do relógio por ciclo: serve de fim da janela e de hora de atualização
+    now = datetime.now(timezone_pt)
+    data_store, errors = load_data_store(store, now)
+    with store['lock']:
+        store.update(data_store=data_store, errors=errors, updated=now)
+
+UPDATER_THREAD_NAME = "evolmerc-updater"
+
+def run_updater(store):
+    # Acorda a cada 60s ou quando 'wake' é sinalizado (botão); sai quando 'stop' é sinalizado
+    while True:
+        store['wake'].wait(60)
+        store['wake'].clear()
+        if store['stop'].is_set():
+            store['executor'].shutdown(wait=False)
+            return
+        try:
+            refresh_store(store)
+        except Exception as e:
+            # Mantém os últimos dados válidos e mostra o erro nos avisos do dashboard
+            logger.exception("Erro na atualização em segundo plano")
+            with store['lock']:
+                store['errors'] = [f"Erro na atualização em segundo plano: {e}"]
+        # Avisa quem espera pelo fim do ciclo (botão "Atualizar Agora")
+        with store['refreshed']:
+            store['refreshed'].notify_all()
+
+@st.cache_resource(show_spinner="A carregar dados...")
+def start_updater():
+    # Uma única thread por processo mantém os dados frescos; os reruns apenas os leem.
+    # Se a cache for limpa (menu ou edição do código), pára a thread anterior antes de
+    # arrancar outra, para nunca haver dois atualizadores a pedir dados em simultâneo.
+    for thread in threading.enumerate():
+        if thread.name == UPDATER_THREAD_NAME:
+            thread.store['stop'].set()
+            thread.store['wake'].set()
+            thread.join(timeout=30)
+    lock = threading.Lock()
+    store = {'lock': lock, 'refreshed': threading.Condition(lock), 'stop': threading.Event(), 'wake': threading.Event(), 'executor': ThreadPoolExecutor(max_workers=len(ASSETS), thread_name_prefix="evolmerc-fetch"), 'disk_cache': get_disk_cache(), 'session': get_http_session(), 'data_store': {}, 'errors': [], 'updated': None}
+    refresh_store(store)
+    thread = threading.Thread(target=run_updater, args=(store,), name=UPDATER_THREAD_NAME, daemon=True)
+    thread.store = store
+    thread.start()
+    return store
 
 # SUBPLOTS para cada ativo
-from plotly.subplots import make_subplots
-import plotly.graph_objects as go
+# Figura memorizada por snapshot: cada refresh_store cria um data_store novo com a sua
+# hora 'updated', que identifica a série completa (inclusive a janela de 5 dias deslizada)
+@st.cache_resource(max_entries=4)
+def build_price_figure(updated, scripts, _data_store):
+    fig = make_subplots(
+        rows=len(scripts), cols=1,
+        shared_xaxes=False,  # cada subplot tem seu próprio eixo X
+        vertical_spacing=0.06,
+        subplot_titles=[ASSETS[s]['name'] for s in scripts]
+    )
 
-# Seleciona apenas ativos com dados suficientes (>1 ponto e preço variável)
-scripts = [s for s in ASSETS.keys() if s in data_store and len(data_store[s]['prices']) > 1 and min(data_store[s]['prices']) != max(data_store[s]['prices'])]
-
-fig = make_subplots(
-    rows=len(scripts), cols=1,
-    shared_xaxes=False,  # cada subplot tem seu próprio eixo X
-    vertical_spacing=0.06,
-    subplot_titles=[ASSETS[s]['name'] for s in scripts]
-)
-
-for i, symbol in enumerate(scripts, 1):
-    data = data_store[symbol]
-    # Sempre formata datas para string legível
-    times = [t.strftime('%d/%m %H:%M') for t in data['times']]
-    prices = pd.Series(data['prices'], index=times)
-    prices = prices.ffill().bfill()  # preenche buracos casuais
-    normalized = (prices - prices.min()) / (prices.max() - prices.min()) * 100
-    fig.add_trace(
-        go.Scatter(
-            x=prices.index,
-            y=normalized,
-            mode='lines+markers',
-            name=ASSETS[symbol]['name'],
-            line=dict(color=ASSETS[symbol]['color'], width=2),
-            marker=dict(size=4),
-            showlegend=False
-        ),
-        row=i, col=1
+    for i, symbol in enumerate(scripts, 1):
+        data = _data_store[symbol]
+        # Sempre formata datas para string legível
+        times = data['times'].strftime('%d/%m %H:%M').to_numpy()
+        fig.add_trace(
+            go.Scattergl(
+                x=times,
+                y=data['normalized'],
+                mode='lines+markers',
+                name=ASSETS[symbol]['name'],
+                line=dict(color=ASSETS[symbol]['color'], width=2),
+                marker=dict(size=4),
+                showlegend=False
+            ),
+            row=i, col=1
+        )
+        # Eixo Y: sempre percentagem de preço normalizado
+        fig.update_yaxes(title_text="Preço Normalizado (%)", row=i, col=1, color=ASSETS[symbol]['color'], tickformat='.0f')
+        # Eixo X: sempre datas legíveis e ângulo de 45º para melhor visualização
+        fig.update_xaxes(title_text="Data/Hora (PT)", row=i, col=1, tickangle=45, tickfont=dict(color='white'))
+    fig.update_layout(
+        title="Evolução dos Preços (Subplots por Ativo • Normalizado 0–100)",
+        height=220 * max(len(scripts),1),
+        plot_bgcolor='#1F2937', paper_bgcolor='#111827',
+        font=dict(color='white', size=12),
+        showlegend=False,
+        margin=dict(l=50, r=50, t=70, b=40)
     )
-    # Eixo Y: sempre percentagem de preço normalizado
-    fig.update_yaxes(title_text="Preço Normalizado (%)", row=i, col=1, color=ASSETS[symbol]['color'], tickformat='.0f')
-    # Eixo X: sempre datas legíveis e ângulo de 45º para melhor visualização
-    fig.update_xaxes(title_text="Data/Hora (PT)", row=i, col=1, tickangle=45, tickfont=dict(color='white'))
-fig.update_layout(
-    title="Evolução dos Preços (Subplots por Ativo • Normalizado 0–100)",
-    height=220 * max(len(scripts),1),
-    plot_bgcolor='#1F2937', paper_bgcolor='#111827',
-    font=dict(color='white', size=12),
-    showlegend=False,
-    margin=dict(l=50, r=50, t=70, b=40)
-)
-if scripts:
-    st.plotly_chart(fig, width="stretch")
-else:
-    st.info("Gráfico: aguardando dados válidos...")
+    return fig
+
+def build_cards_html(data_store):
+    # Cartões dos ativos
+    cards_parts = ["<div style='display: flex; flex-wrap: wrap; justify-content: space-around; gap: 15px; padding: 20px;'>"]
+    for symbol, info in ASSETS.items():
+        data = data_store.get(symbol)
+        border_color = info['color']
+        card_bg = '#1F2937'
+        if not data:
+            cards_parts.append(f"""
+            <div style='background: {card_bg}; padding: 20px; border-radius: 10px; border: 2px solid {border_color}; flex: 1; min-width: 260px; max-width: 300px; box-shadow: 0 4px 6px rgba(0,0,0,0.3);'>
+                <h3 style='color: white; margin: 0 0 10px 0; font-size: 18px;'>{info['name']}</h3>
+                <p style='color: #9CA3AF; font-size: 14px;'>Sem dados</p>
+            </div>""")
+            continue
+        price_str = f"{info['unit']}{data['current_price']:.2f}" if info['unit'] else f"{data['current_price']:.2f}"
+        hora_pt = data['last_time'].strftime("%d/%m %H:%M")
+        change_sign = "↑" if data['change'] >= 0 else "↓"
+        change_color = "#10B981" if data['change'] >= 0 else "#EF4444"
+        cards_parts.append(f"""
+        <div style='background: {card_bg}; padding: 20px; border-radius: 10px; border: 2px solid {border_color}; box-shadow: 0 4px 6px rgba(0,0,0,0.3); flex: 1; min-width: 260px; max-width: 300px;'>
+            <h3 style='color: white; margin: 0 0 8px 0; font-size: 18px;'>{info['name']}</h3>
+            <div style='font-size: 28px; font-weight: bold; color: white; margin-bottom: 5px;'>{price_str}</div>
+            <div style='font-size: 12px; color: #9CA3AF; margin-bottom: 10px;'>{hora_pt} (PT)</div>
+            <div style='display: flex; justify-content: space-between; margin-bottom: 10px;'>
+                <span style='color: {change_color}; font-size: 16px;'>{change_sign} {abs(data['change']):.4f}</span>
+                <span style='color: {change_color}; font-size: 16px;'>({data['change_pct']:+.2f}%)</span>
+            </div>
+            <hr style='border-color: #374151; margin: 12px 0;'>
+            <div style='font-size: 14px; color: #9CA3AF;'>Tendência: <span style='color: {data['trend_color']}; font-weight: bold;'>{data['trend']}</span></div>
+            <div style='font-size: 14px; color: #9CA3AF; margin-top: 5px;'>Inclinação: <span style='color: white; font-weight: bold;'>{data['angle']:.1f}°</span></div>
+        </div>""")
+    cards_parts.append("</div>")
+    return "".join(cards_parts)
+
+@st.fragment(run_every=10)
+def render_dashboard(store):
+    with store['lock']:
+        data_store, errors, updated = store['data_store'], store['errors'], store['updated']
+    for error in errors:
+        st.warning(error)
+
+    # Header (botão update)
+    col1, col2 = st.columns([1, 6])
+    with col1:
+        if st.button("🔄 Atualizar Agora"):
+            # Não pede dados na thread do script: acorda o atualizador, que é o único a
+            # chamar refresh_store, e espera pelo fim do ciclo para mostrar os dados novos
+            store['disk_cache'].clear()
+            with st.spinner("A atualizar..."), store['refreshed']:
+                store['wake'].set()
+                store['refreshed'].wait(timeout=15)
+            st.rerun(scope="fragment")
+    with col2:
+        st.markdown(f"<p style='text-align: right; color: #6B7280; font-size: 14px;'>Última atualização: {updated.strftime('%d/%m/%Y %H:%M:%S')} (PT)</p>", unsafe_allow_html=True)
+
+    # Cada refresh_store cria um snapshot novo: enquanto 'updated' não mudar,
+    # reutiliza os cartões e a figura já construídos nesta sessão
+    cached = st.session_state.get('render_cache')
+    if cached is None or cached['updated'] != updated:
+        # Seleciona apenas ativos com dados suficientes (>1 ponto e preço variável)
+        scripts = [s for s in ASSETS.keys() if s in data_store and len(data_store[s]['prices']) > 1 and np.ptp(data_store[s]['prices']) > 0]
+        cached = {'updated': updated, 'cards_html': build_cards_html(data_store), 'scripts': scripts, 'fig': build_price_figure(updated, tuple(scripts), data_store) if scripts else None}
+        st.session_state.render_cache = cached
 
+    st.markdown(cached['cards_html'], unsafe_allow_html=True)
+    if cached['scripts']:
+        st.plotly_chart(cached['fig'], width="stretch")
+    else:
+        st.info("Gráfico: aguardando dados válidos...")
 
+render_dashboard(start_updater())
 
 st.markdown("---")
 st.markdown("""
@@ -173,4 +293,4 @@ st.markdown("""
         <h3 style='color: #1F2937; margin: 0 0 10px 0;'>AVISO</h3>
         <p style='color: #1F2937; font-size: 14px; margin: 0;'>Dados do Yahoo Finance. Para trading real, use APIs profissionais.</p>
     </div>""", unsafe_allow_html=True)
-st.caption("Atualização automática a cada 60s (via cache) • Hora PT em todos os cards")
+st.caption("Atualização automática a cada 60s (em segundo plano) • Hora PT em todos os cards")
@@ -0,0 +1,48 @@
+"""
+Kernels numéricos compilados com Numba para o dashboard.
+Ficam num módulo à parte para o Streamlit não os recompilar a cada rerun.
+"""
+
+import math
+
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True, fastmath=True)
+def slopes_and_norm(P, lens):
+    """Inclinação, ângulo e curva normalizada (0-100) de cada ativo numa só passagem.
+
+    P é uma matriz [ativo, t] (float32) preenchida com NaN após lens[ativo] pontos.
+    As somas acumulam em float64; a curva normalizada sai com o dtype de P.
+    """
+    n_assets = P.shape[0]
+    slopes = np.zeros(n_assets)
+    angles = np.zeros(n_assets)
+    normalized = np.empty_like(P)
+    normalized[:] = np.nan
+    for a in range(n_assets):
+        n = lens[a]
+        if n < 2:
+            continue
+        # Somas da regressão linear e min/max no mesmo ciclo
+        sum_y = 0.0
+        sum_xy = 0.0
+        mn = P[a, 0]
+        mx = P[a, 0]
+        for t in range(n):
+            y = P[a, t]
+            sum_y += y
+            sum_xy += t * y
+            if y < mn:
+                mn = y
+            if y > mx:
+                mx = y
+        # Com x = 0..n-1: Sxy = sum_xy - (n-1)/2 * sum_y e Sxx = n(n²-1)/12
+        slope = (sum_xy - 0.5 * (n - 1) * sum_y) * 12.0 / (n * (n * n - 1.0))
+        slopes[a] = slope
+        angles[a] = math.degrees(math.atan(slope))
+        span = mx - mn
+        for t in range(n):
+            normalized[a, t] = (P[a, t] - mn) / span * 100.0 if span > 0 else 50.0
+    return slopes, angles, normalized
@@ -12,6 +12,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import yfinance as yf
+import atexit
+import random
 import threading
 import time
 
@@ -30,13 +32,21 @@ ASSETS = {
 data_store = {}
 last_update = None
 
+# Intervalo de atualização e espera máxima após falhas consecutivas (segundos)
+UPDATE_INTERVAL = 60
+MAX_BACKOFF = 300
+
+# Sinal de paragem da thread de atualização (acorda-a de imediato ao sair)
+stop_event = threading.Event()
+atexit.register(stop_event.set)
+
 def calculate_slope(prices):
     """Calcula a inclinação da tendência (regressão linear)"""
     if len(prices) < 2:
         return 0, 0
     
     x = np.arange(len(prices))
-    y = np.array(prices)
+    y = np.asarray(prices, dtype=np.float64)
     
     # Regressão linear
     coeffs = np.polyfit(x, y, 1)
@@ -74,8 +84,9 @@ def fetch_asset_data(symbol, minutes=3):
         if df.empty:
             return None
         
-        prices = df['Close'].tolist()
-        times = df.index.tolist()
+        # Arrays NumPy e DatetimeIndex em vez de listas de objetos Python
+        prices = df['Close'].to_numpy(dtype=np.float64)
+        times = df.index
         
         if len(prices) < 2:
             return None
@@ -106,19 +117,32 @@ def fetch_asset_data(symbol, minutes=3):
         return None
 
 def update_all_data():
-    """Atualiza dados de todos os ativos"""
+    """Atualiza dados de todos os ativos, com recuo exponencial por ativo em caso de falha"""
     global data_store, last_update
     
-    while True:
+    backoff = {symbol: 0 for symbol in ASSETS}
+    retry_at = {symbol: 0.0 for symbol in ASSETS}
+    
+    # Pequeno desvio aleatório para não pedir todos os ativos sempre no mesmo instante
+    while not stop_event.wait(UPDATE_INTERVAL + random.uniform(0, 5)):
         print(f"[{datetime.now().strftime('%H:%M:%S')}] Atualizando dados...")
         
         for symbol in ASSETS.keys():
+            if stop_event.is_set():
+                return
+            if time.time() < retry_at[symbol]:
+                continue
+            
             data = fetch_asset_data(symbol, minutes=3)
             if data:
                 data_store[symbol] = data
+                backoff[symbol] = 0
+            else:
+                # Falha ou sem dados: espera 60s, 120s, ... até MAX_BACKOFF
+                backoff[symbol] = min(max(backoff[symbol] * 2, UPDATE_INTERVAL), MAX_BACKOFF)
+                retry_at[symbol] = time.time() + backoff[symbol]
         
         last_update = datetime.now()
-        time.sleep(60)  # Atualiza a cada 60 segundos
 
 # Inicializa Dash app
 app = dash.Dash(__name__)
@@ -231,9 +255,13 @@ def update_dashboard(n):
         if data:
             # Normaliza os preços para comparação visual
             prices = data['prices']
-            normalized = [(p - min(prices)) / (max(prices) - min(prices)) * 100 if max(prices) != min(prices) else 50 for p in prices]
+            p_min, p_max = prices.min(), prices.max()
+            if p_max != p_min:
+                normalized = (prices - p_min) / (p_max - p_min) * 100
+            else:
+                normalized = np.full_like(prices, 50.0)
             
-            times = [t.strftime('%H:%M:%S') for t in data['times']]
+            times = data['times'].strftime('%H:%M:%S').to_numpy()
             
             fig.add_trace(go.Scatter(
                 x=times,